@@ -13,7 +13,10 @@ Cambios v7
 import streamlit as st
 import pandas as pd
 import numpy as np
-import requests, math, os, pytz
+import requests, math, os, time, threading, functools, orjson, pytz
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import date, datetime, timezone
 
 st.set_page_config(page_title="Daily Sports Predictions", layout="centered")
@@ -27,19 +30,150 @@ DATE_STR = TODAY.strftime("%Y-%m-%d")
 TZ_LIMA = pytz.timezone("America/Lima")
 FIRST_HALF_FACTOR = 0.46
 
-@st.cache_data(ttl=60*60)
-def get_espn_scoreboard(date_str):
-    url = f"https://site.web.api.espn.com/apis/v2/sports/soccer/fifa.world/scoreboard?dates={date_str}"
+# Sesión HTTP compartida (keep-alive + reintentos) para todas las llamadas a ESPN.
+# En cache_resource para que el pool sobreviva a los reruns de Streamlit.
+@st.cache_resource
+def get_session():
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                          max_retries=Retry(total=2, backoff_factor=0.3))
+    s.mount("https://", adapter); s.mount("http://", adapter)
+    s.headers["User-Agent"] = "Mozilla/5.0 (sports_dash)"
+    return s
+
+SESSION = get_session()
+
+# ETag + payload por URL: al expirar el TTL se revalida con If-None-Match (304 sin cuerpo)
+@st.cache_resource
+def _etags():
+    return {}
+
+# Rutas de liga ESPN (sport/league) usadas por los bloques
+SOCCER = "soccer/fifa.world"
+WNBA = "basketball/wnba"
+
+def _scoreboard_url(date_str, league):
+    return f"https://site.web.api.espn.com/apis/v2/sports/{league}/scoreboard?dates={date_str}"
+
+def _download_scoreboard(date_str, league, etags):
+    url = _scoreboard_url(date_str, league)
+    etag, cached = etags.get(url, (None, None))
+    r = SESSION.get(url, headers={"If-None-Match": etag} if etag else None, timeout=(3, 12))
+    if r.status_code == 304 and cached is not None:
+        return cached
+    r.raise_for_status()
+    data = orjson.loads(r.content)
+    if r.headers.get("ETag"):
+        etags[url] = (r.headers["ETag"], data)
+    return data
+
+# TTL diferenciado: el marcador del día cambia minuto a minuto en horario de partidos;
+# fechas pasadas/futuras o fuera de ese horario apenas cambian.
+LIVE_TTL = 60
+IDLE_TTL = 60*60
+# Pasado el TTL se sirve la copia anterior y se revalida en segundo plano
+# (stale-while-revalidate); más allá de este límite se espera a la descarga.
+STALE_MAX_AGE = 24*60*60
+
+def _fresh_ttl(date_str):
+    now = datetime.now(TZ_LIMA)
+    live = date_str == now.strftime("%Y-%m-%d") and now.hour >= 10
+    return LIVE_TTL if live else IDLE_TTL
+
+# (ts último OK, payload, ts del último fallo o 0) por (liga, fecha) + descargas en curso;
+# sobrevive a reruns
+@st.cache_resource
+def _scoreboards():
+    return {"entries": {}, "inflight": set(), "lock": threading.Lock()}
+
+def _prune(store, etags):
+    """Descarta (con su ETag) las entradas sin actividad en STALE_MAX_AGE; llamar con el lock."""
+    cutoff = time.time()-STALE_MAX_AGE
+    for (league, date_str), (ts, _, failed_at) in list(store["entries"].items()):
+        if max(ts, failed_at) < cutoff:
+            del store["entries"][(league, date_str)]
+            etags.pop(_scoreboard_url(date_str, league), None)
+
+def refresh_scoreboard(date_str, league, store=None, etags=None, background=False):
+    store = store if store is not None else _scoreboards()
+    etags = etags if etags is not None else _etags()
+    key = (league, date_str); started = time.time()
     try:
-        return requests.get(url, timeout=15).json()
+        data = _download_scoreboard(date_str, league, etags)
     except Exception:
-        return {}
+        data = None
+    with store["lock"]:
+        if data is not None:
+            store["entries"][key] = (time.time(), data, 0)
+        else:
+            ts, old, _ = store["entries"].get(key, (0, {}, 0))
+            # Si otra descarga tuvo éxito mientras tanto, su copia no se marca como fallida
+            if ts < started:
+                store["entries"][key] = (ts, old, time.time())
+        _prune(store, etags)
+        if background:
+            # Sólo la revalidación lanzada por _revalidate_async marcó la clave como en curso
+            store["inflight"].discard(key)
+
+def refresh_all(date_str):
+    """Descarga en paralelo y espera los marcadores de todas las ligas (botón Refrescar)."""
+    store, etags = _scoreboards(), _etags()
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        list(ex.map(lambda lg: refresh_scoreboard(date_str, lg, store, etags), (SOCCER, WNBA)))
+
+def _revalidate_async(date_str, league, store):
+    key = (league, date_str)
+    with store["lock"]:
+        if key in store["inflight"]:
+            return
+        store["inflight"].add(key)
+    threading.Thread(target=refresh_scoreboard, args=(date_str, league, store, _etags(), True),
+                     daemon=True).start()
 
-# Utilidad para convertir ISO a Lima hh:mm
+def get_espn_scoreboard(date_str, league=SOCCER):
+    store = _scoreboards(); key = (league, date_str)
+    ts, data, failed_at = store["entries"].get(key, (0, {}, 0))
+    now = time.time(); age = now-ts
+    if data and age < _fresh_ttl(date_str):
+        return data
+    # Tras un fallo no se reintenta durante LIVE_TTL: evita bloquear cada rerun si ESPN cae
+    if failed_at and now-failed_at < LIVE_TTL:
+        return data if data and age < STALE_MAX_AGE else {}
+    if data and age < STALE_MAX_AGE:
+        _revalidate_async(date_str, league, store)
+        return data
+    refresh_scoreboard(date_str, league, store)
+    ts, data, _ = store["entries"].get(key, (0, {}, 0))
+    return data if data and time.time()-ts < STALE_MAX_AGE else {}
+
+def is_stale(date_str, league=SOCCER):
+    """True si ESPN falló y se está sirviendo una copia anterior válida."""
+    ts, data, failed_at = _scoreboards()["entries"].get((league, date_str), (0, {}, 0))
+    return bool(failed_at and data and time.time()-ts < STALE_MAX_AGE)
+
+def prefetch(date_str, league):
+    """Calienta en segundo plano las demás ligas sin esperarlas; la liga del bloque
+    visible la descarga su propio predictor."""
+    store = _scoreboards(); now = time.time()
+    for lg in (SOCCER, WNBA):
+        if lg == league:
+            continue
+        ts, data, failed_at = store["entries"].get((lg, date_str), (0, {}, 0))
+        fresh = data and now-ts < _fresh_ttl(date_str)
+        backoff = failed_at and now-failed_at < LIVE_TTL
+        if not fresh and not backoff:
+            _revalidate_async(date_str, lg, store)
+
+# Utilidad para convertir ISO a Lima hh:mm (memoizada: los mismos kickoffs se repiten)
+@functools.lru_cache(maxsize=256)
 def iso_to_lima(iso):
     try:
-        dt = datetime.fromisoformat(iso.replace("Z","+00:00")).astimezone(TZ_LIMA)
-        return dt.strftime("%H:%M")
+        if iso.endswith("Z"):
+            dt = datetime.fromisoformat(iso[:-1]).replace(tzinfo=timezone.utc)
+        else:
+            dt = datetime.fromisoformat(iso)
+        dt = dt.astimezone(TZ_LIMA)
+        return f"{dt.hour:02d}:{dt.minute:02d}"
     except Exception:
         return "—"
 
@@ -47,108 +181,149 @@ def iso_to_lima(iso):
 # Modelo Poisson simplificado – sólo para CONMEBOL en demo
 # ----------------------------------------------------------------------------
 
-STATIC_STAND = pd.DataFrame({
-    "Team": ["Argentina","Ecuador","Paraguay","Brazil","Colombia","Uruguay","Venezuela","Bolivia","Peru","Chile"],
-    "MP": [15]*10,
-    "GF": [27,13,13,20,18,17,15,14,6,9],
-    "GA": [8,5,9,16,14,12,17,32,17,22],
-    "Cards": [2.6,2.8,3.0,2.9,3.1,2.7,3.2,3.4,3.3,3.1],
-    "COR": [5.2,4.8,4.9,6.1,5.4,5.0,4.7,3.9,4.2,4.5]
-}).set_index("Team")
-
 alpha=1.5
-league_avg=((STATIC_STAND["GF"]+alpha).sum()/(STATIC_STAND["MP"]+alpha).sum())/2
-STATIC_STAND["atk"]=((STATIC_STAND["GF"]+alpha)/(STATIC_STAND["MP"]+alpha))/league_avg
-STATIC_STAND["def"]=((STATIC_STAND["GA"]+alpha)/(STATIC_STAND["MP"]+alpha))/league_avg
 
-def poisson(l,k):
-    return math.exp(-l)*(l**k)/math.factorial(k)
+@st.cache_resource
+def load_standings():
+    stand = pd.DataFrame({
+        "Team": ["Argentina","Ecuador","Paraguay","Brazil","Colombia","Uruguay","Venezuela","Bolivia","Peru","Chile"],
+        "MP": [15]*10,
+        "GF": [27,13,13,20,18,17,15,14,6,9],
+        "GA": [8,5,9,16,14,12,17,32,17,22],
+        "Cards": [2.6,2.8,3.0,2.9,3.1,2.7,3.2,3.4,3.3,3.1],
+        "COR": [5.2,4.8,4.9,6.1,5.4,5.0,4.7,3.9,4.2,4.5]
+    }).astype({"MP":"int16","GF":"int16","GA":"int16"}).set_index("Team")
+    avg=((stand["GF"]+alpha).sum()/(stand["MP"]+alpha).sum())/2
+    stand["atk"]=((stand["GF"]+alpha)/(stand["MP"]+alpha))/avg
+    stand["def"]=((stand["GA"]+alpha)/(stand["MP"]+alpha))/avg
+    return stand, avg
+
+# Índice equipo→fila y columnas del modelo como arrays contiguos (lookups vectorizados)
+@st.cache_resource
+def build_poisson_model():
+    stand, _ = load_standings()
+    idx = {t: i for i, t in enumerate(stand.index)}
+    return (idx,) + tuple(stand[c].to_numpy(np.float64) for c in ("atk","def","Cards","COR"))
+
+_, league_avg = load_standings()
+TEAM_IDX, ATK, DEF, CARDS, COR = build_poisson_model()
+
+# Rejilla de marcadores 0..6 × 0..6 precalculada (índices y k!)
+K = np.arange(7)
+FACT = np.array([math.factorial(k) for k in K], dtype=np.float64)
+# Máscaras fijas sobre la rejilla (filas = goles local, columnas = goles visita)
+HOME_MASK = np.tri(7, k=-1)
+AWAY_MASK = HOME_MASK.T
+DRAW_MASK = np.eye(7)
+# Under 2.5 cae entero dentro de la rejilla: P(>2.5) = 1 − P(≤2) es exacto pese al truncado
+UNDER25_MASK = (np.add.outer(K, K) <= 2).astype(np.float64)
+
+def poisson_grid(lam_h, lam_a):
+    """Rejillas de marcadores (N,7,7) para N partidos a partir de λ local/visita."""
+    ph = np.exp(-lam_h)[:,None] * lam_h[:,None]**K / FACT
+    pa = np.exp(-lam_a)[:,None] * lam_a[:,None]**K / FACT
+    return ph[:,:,None] * pa[:,None,:]
 
 # ----------------------------------------------------------------------------
 # Funciones de predicción por bloque
 # ----------------------------------------------------------------------------
 
-def conmebol_predictions():
-    sb = get_espn_scoreboard(DATE_STR)
-    rows = []
-    for ev in sb.get("events", []):
+@st.cache_data(ttl=LIVE_TTL)
+def soccer_comps_by_league(date_str):
+    """Competiciones del marcador de fútbol repartidas por bloque en una sola pasada."""
+    buckets = {"WCQ": [], "uefa": []}
+    for ev in get_espn_scoreboard(date_str).get("events", []):
         comp = ev["competitions"][0]
-        if comp.get("league", {}).get("abbreviation") != "WCQ":
+        if comp.get("league", {}).get("abbreviation") == "WCQ":
+            buckets["WCQ"].append(comp)
+        elif comp.get("type", {}).get("slug") == "uefa":
+            buckets["uefa"].append(comp)
+    return buckets
+
+@st.cache_data(ttl=LIVE_TTL)
+def conmebol_predictions(date_str):
+    kick, homes, aways, odds = [], [], [], []
+    for comp in soccer_comps_by_league(date_str)["WCQ"]:
+        if len(comp["competitors"]) != 2:
             continue
-        teams = {t["homeAway"]: t for t in comp["competitors"]}
-        home = teams.get("home"); away = teams.get("away")
+        c0, c1 = comp["competitors"]
+        home, away = (c0, c1) if c0["homeAway"] == "home" else (c1, c0)
         h_name = home["team"]["shortDisplayName"]; a_name = away["team"]["shortDisplayName"]
-        lam_h = league_avg*STATIC_STAND.at[h_name,'atk']*STATIC_STAND.at[a_name,'def']*1.12
-        lam_a = league_avg*STATIC_STAND.at[a_name,'atk']*STATIC_STAND.at[h_name,'def']
-        lam_tot=lam_h+lam_a; exp1h=round(lam_tot*FIRST_HALF_FACTOR,2)
-        p_home=p_draw=p_away=p_o25=0
-        for i in range(7):
-            for j in range(7):
-                p=poisson(lam_h,i)*poisson(lam_a,j)
-                if i>j: p_home+=p
-                elif i==j: p_draw+=p
-                else: p_away+=p
-                if i+j>2: p_o25+=p
+        if h_name not in TEAM_IDX or a_name not in TEAM_IDX:
+            continue
         # Odds ESPN
-        odds_h = None
+        odds_h = np.nan
         if comp.get("odds"):
             try:
                 odds_h = float(comp["odds"][0]["details"].split(" ")[0])
             except Exception:
                 pass
-        rows.append({
-            "Kickoff": iso_to_lima(comp["date"]),
-            "Home": h_name,
-            "Away": a_name,
-            "Exp_H": round(lam_h,2), "Exp_A": round(lam_a,2),
-            "Exp_1H": exp1h,
-            "P(H)": round(p_home,3), "P(D)": round(p_draw,3), "P(A)": round(p_away,3),
-            "P(>2.5)": round(p_o25,3),
-            "Avg_Cards": round((STATIC_STAND.at[h_name,'Cards']+STATIC_STAND.at[a_name,'Cards'])/2,2),
-            "Avg_COR": round((STATIC_STAND.at[h_name,'COR']+STATIC_STAND.at[a_name,'COR'])/2,1),
-            "Odds_H": odds_h,
-            "Edge%": round((p_home - (1/odds_h if odds_h else np.nan))*100,1) if odds_h else "—"
-        })
-    return pd.DataFrame(rows)
-
-
-def uefa_predictions():
-    sb = get_espn_scoreboard(DATE_STR)
-    rows=[]
-    for ev in sb.get("events", []):
-        comp=ev["competitions"][0]
-        if comp.get("type",{}).get("slug")!="uefa":
+        kick.append(iso_to_lima(comp["date"])); homes.append(h_name); aways.append(a_name)
+        odds.append(odds_h)
+    if not homes:
+        return pd.DataFrame()
+    # Todos los partidos a la vez: λ y rejillas (N,7,7) vectorizadas
+    h = np.array([TEAM_IDX[t] for t in homes]); a = np.array([TEAM_IDX[t] for t in aways])
+    lam_h = league_avg*ATK[h]*DEF[a]*1.12
+    lam_a = league_avg*ATK[a]*DEF[h]
+    M = poisson_grid(lam_h, lam_a)
+    p_home=(M*HOME_MASK).sum((1,2)); p_draw=(M*DRAW_MASK).sum((1,2)); p_away=(M*AWAY_MASK).sum((1,2))
+    p_o25=1.0-(M*UNDER25_MASK).sum((1,2))
+    odds = np.array(odds)
+    # Como en v7: Edge% para cualquier cuota no nula (incluidas americanas negativas)
+    has_odds = ~np.isnan(odds) & (odds != 0)
+    inv = np.divide(1.0, odds, out=np.full_like(odds, np.nan), where=has_odds)
+    edge = np.round((p_home - inv)*100, 1)
+    return pd.DataFrame({
+        "Kickoff": kick,
+        "Home": homes,
+        "Away": aways,
+        "Exp_H": np.round(lam_h,2), "Exp_A": np.round(lam_a,2),
+        "Exp_1H": np.round((lam_h+lam_a)*FIRST_HALF_FACTOR,2),
+        "P(H)": np.round(p_home,3), "P(D)": np.round(p_draw,3), "P(A)": np.round(p_away,3),
+        "P(>2.5)": np.round(p_o25,3),
+        "Avg_Cards": np.round((CARDS[h]+CARDS[a])/2,2),
+        "Avg_COR": np.round((COR[h]+COR[a])/2,1),
+        "Odds_H": odds,
+        "Edge%": [e if o else "—" for e, o in zip(edge, has_odds)]
+    })
+
+
+def matchups(comps):
+    """Columnas (fechas ISO, locales, visitas); se omiten competiciones sin exactamente 2 equipos."""
+    dates, homes, aways = [], [], []
+    for comp in comps:
+        cs = comp.get("competitors") or []
+        if len(cs) != 2:
             continue
-        teams={t["homeAway"]:t for t in comp["competitors"]}
-        home=teams["home"]; away=teams["away"]
-        rows.append({
-            "Kickoff": iso_to_lima(comp["date"]),
-            "Home": home["team"]["shortDisplayName"],
-            "Away": away["team"]["shortDisplayName"],
-            "Exp_1H":"—","P(H)":0.5,"P(D)":0.25,"P(A)":0.25,
-            "Avg_Cards":"—","Avg_COR":"—","Odds_H":"—","Edge%":"—"
-        })
-    return pd.DataFrame(rows)
-
-
-def wnba_predictions():
-    url=f"https://site.web.api.espn.com/apis/v2/sports/basketball/wnba/scoreboard?dates={DATE_STR}"
-    data=get_espn_scoreboard(DATE_STR)
-    rows=[]
-    for ev in data.get('events',[]):
-        comp=ev['competitions'][0]
-        h=a=None
-        for t in comp['competitors']:
-            if t['homeAway']=='home': h=t
-            else: a=t
-        rows.append({
-            "Kickoff": iso_to_lima(comp['date']),
-            "Home": h['team']['shortDisplayName'],
-            "Away": a['team']['shortDisplayName'],
-            "Exp_1H":"—","P(Home)":0.5,"P(Away)":0.5,
-            "Odds_H":"—"
-        })
-    return pd.DataFrame(rows)
+        c0, c1 = cs
+        home, away = (c0, c1) if c0["homeAway"] == "home" else (c1, c0)
+        dates.append(comp.get("date"))
+        homes.append(home["team"]["shortDisplayName"]); aways.append(away["team"]["shortDisplayName"])
+    return dates, homes, aways
+
+
+@st.cache_data(ttl=LIVE_TTL)
+def uefa_predictions(date_str):
+    dates, homes, aways = matchups(soccer_comps_by_league(date_str)["uefa"])
+    return pd.DataFrame({
+        "Kickoff": [iso_to_lima(d) for d in dates],
+        "Home": homes, "Away": aways,
+        "Exp_1H":"—","P(H)":0.5,"P(D)":0.25,"P(A)":0.25,
+        "Avg_Cards":"—","Avg_COR":"—","Odds_H":"—","Edge%":"—"
+    })
+
+
+@st.cache_data(ttl=LIVE_TTL)
+def wnba_predictions(date_str):
+    sb = get_espn_scoreboard(date_str, WNBA)
+    dates, homes, aways = matchups([e["competitions"][0] for e in sb.get("events", [])])
+    return pd.DataFrame({
+        "Kickoff": [iso_to_lima(d) for d in dates],
+        "Home": homes, "Away": aways,
+        "Exp_1H":"—","P(Home)":0.5,"P(Away)":0.5,
+        "Odds_H":"—"
+    })
 
 # ----------------------------------------------------------------------------
 # UI
@@ -157,13 +332,23 @@ def wnba_predictions():
 MODS={"Fútbol – Sudamérica":conmebol_predictions,
       "Fútbol – Europa (UEFA)":uefa_predictions,
       "Basketball – WNBA":wnba_predictions}
+LEAGUE_OF={"Fútbol – Sudamérica":SOCCER,
+           "Fútbol – Europa (UEFA)":SOCCER,
+           "Basketball – WNBA":WNBA}
 sel=st.sidebar.radio("Bloque:",list(MODS.keys()))
 if st.sidebar.button("🔄 Refrescar ahora"):
-    st.cache_data.clear(); st.rerun()
+    # Sólo datos en vivo; la tabla de posiciones estática se conserva
+    refresh_all(DATE_STR)
+    soccer_comps_by_league.clear()
+    for fn in MODS.values(): fn.clear()
+    st.rerun()
 
 st.title(f"Predicciones • {DATE_STR}")
 
-df=MODS[sel]()
+prefetch(DATE_STR, LEAGUE_OF[sel])
+df=MODS[sel](DATE_STR)
+if is_stale(DATE_STR, LEAGUE_OF[sel]):
+    st.toast("Datos en caché — fuente caída")
 if 'Kickoff' in df.columns:
     df=df[['Kickoff']+[c for c in df.columns if c!='Kickoff']]
 if df.empty: